@@ -0,0 +1,150 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Relation interface library for data platform products (vendored subset).
+
+This is a trimmed vendored copy of the upstream data_platform_libs
+``data_interfaces`` library, cut down to the pieces this charm uses: the
+requirer side of the ``postgresql_client`` interface, its
+``database_created`` and ``endpoints_changed`` events, and the helpers
+for locating the credentials secret.
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional
+
+import ops
+
+LIBAPI = 0
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+PROV_SECRET_PREFIX = "secret-"
+
+
+class _SecretGroups:
+    """The groups the provider may split its secret fields into."""
+
+    USER = "user"
+    TLS = "tls"
+    EXTRA = "extra"
+
+
+SECRET_GROUPS = _SecretGroups()
+
+
+class _Diff:
+    """The changes in one databag between two relation-changed events."""
+
+    def __init__(self, added: set, changed: set, deleted: set):
+        self.added = added
+        self.changed = changed
+        self.deleted = deleted
+
+
+class DatabaseRequiresEvent(ops.RelationEvent):
+    """Base class for database relation events on the requirer side."""
+
+    @property
+    def endpoints(self) -> Optional[str]:
+        """A comma-separated list of read/write endpoints."""
+        if not self.relation.app:
+            return None
+        return self.relation.data[self.relation.app].get("endpoints")
+
+
+class DatabaseCreatedEvent(DatabaseRequiresEvent):
+    """The requested database has been created and credentials shared."""
+
+
+class DatabaseEndpointsChangedEvent(DatabaseRequiresEvent):
+    """The database's read/write endpoints have changed."""
+
+
+class DatabaseRequiresEvents(ops.ObjectEvents):
+    """Database events the requirer side can emit."""
+
+    database_created = ops.EventSource(DatabaseCreatedEvent)
+    endpoints_changed = ops.EventSource(DatabaseEndpointsChangedEvent)
+
+
+class DatabaseRequires(ops.Object):
+    """Requirer side of the database relation."""
+
+    on = DatabaseRequiresEvents()  # type: ignore[reportAssignmentType]
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        relation_name: str,
+        database_name: str,
+        extra_user_roles: Optional[str] = None,
+    ):
+        super().__init__(charm, relation_name)
+        self.charm = charm
+        self.relation_name = relation_name
+        self.database_name = database_name
+        self.extra_user_roles = extra_user_roles
+        self.framework.observe(
+            charm.on[relation_name].relation_joined, self._on_relation_joined_event
+        )
+        self.framework.observe(
+            charm.on[relation_name].relation_changed, self._on_relation_changed_event
+        )
+
+    @property
+    def relations(self) -> List[ops.Relation]:
+        """The established relations on this interface."""
+        return list(self.charm.model.relations[self.relation_name])
+
+    def _generate_secret_label(self, relation_name: str, relation_id: int, group: str) -> str:
+        """The label under which a provider-shared secret is cached."""
+        return f"{relation_name}.{relation_id}.{group}.secret"
+
+    def fetch_relation_field(self, relation_id: int, field: str) -> Optional[str]:
+        """Read a single field of the remote application databag."""
+        for relation in self.relations:
+            if relation.id == relation_id and relation.app:
+                return relation.data[relation.app].get(field)
+        return None
+
+    def _on_relation_joined_event(self, event: ops.RelationJoinedEvent):
+        if not self.charm.unit.is_leader():
+            return
+        data = {"database": self.database_name}
+        if self.extra_user_roles:
+            data["extra-user-roles"] = self.extra_user_roles
+        event.relation.data[self.charm.app].update(data)
+
+    def _diff(self, event: ops.RelationChangedEvent) -> _Diff:
+        """The remote databag changes since the last relation-changed."""
+        if not event.relation.app:
+            return _Diff(set(), set(), set())
+        old_data: Dict[str, str] = json.loads(
+            event.relation.data[self.charm.unit].get("data", "{}")
+        )
+        new_data = dict(event.relation.data[event.relation.app])
+        added = new_data.keys() - old_data.keys()
+        deleted = old_data.keys() - new_data.keys()
+        changed = {
+            key for key in old_data.keys() & new_data.keys() if old_data[key] != new_data[key]
+        }
+        event.relation.data[self.charm.unit]["data"] = json.dumps(new_data)
+        return _Diff(added, changed, deleted)
+
+    def _on_relation_changed_event(self, event: ops.RelationChangedEvent):
+        diff = self._diff(event)
+        if (
+            "username" in diff.added
+            or f"{PROV_SECRET_PREFIX}{SECRET_GROUPS.USER}" in diff.added
+        ):
+            logger.info("database created at %s", event.relation.name)
+            self.on.database_created.emit(event.relation, app=event.app, unit=event.unit)
+            # The initial endpoints arrive alongside the credentials;
+            # don't also emit endpoints-changed for them.
+            return
+        if "endpoints" in diff.added or "endpoints" in diff.changed:
+            logger.info("endpoints changed on %s", event.relation.name)
+            self.on.endpoints_changed.emit(event.relation, app=event.app, unit=event.unit)
@@ -0,0 +1,62 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Grafana dashboard interface library (vendored subset).
+
+This is a trimmed vendored copy of the upstream grafana-k8s
+``grafana_dashboard`` library, cut down to the provider side that this
+charm uses: shipping the bundled dashboards to Grafana.
+"""
+
+import base64
+import json
+import logging
+import lzma
+import pathlib
+
+import ops
+
+LIBAPI = 0
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELATION_NAME = "grafana-dashboard"
+DEFAULT_DASHBOARDS_PATH = "src/grafana_dashboards"
+
+
+def _encode_dashboard_content(content: str) -> str:
+    """Compress and encode a dashboard for transfer over the databag."""
+    return base64.b64encode(lzma.compress(content.encode())).decode()
+
+
+class GrafanaDashboardProvider(ops.Object):
+    """Provider side of the grafana-dashboard relation."""
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        relation_name: str = DEFAULT_RELATION_NAME,
+        dashboards_path: str = DEFAULT_DASHBOARDS_PATH,
+    ):
+        super().__init__(charm, relation_name)
+        self._charm = charm
+        self._relation_name = relation_name
+        self._dashboards_path = pathlib.Path(charm.charm_dir, dashboards_path)
+        self.framework.observe(
+            charm.on[relation_name].relation_created, self._on_relation_created
+        )
+
+    def _on_relation_created(self, event: ops.RelationCreatedEvent):
+        if not self._charm.unit.is_leader():
+            return
+        templates = {}
+        if self._dashboards_path.is_dir():
+            for path in sorted(self._dashboards_path.glob("*.json")):
+                templates[f"file:{path.stem}"] = {
+                    "charm": self._charm.meta.name,
+                    "content": _encode_dashboard_content(path.read_text()),
+                }
+        event.relation.data[self._charm.app]["dashboards"] = json.dumps(
+            {"templates": templates, "uuid": self._charm.app.name}
+        )
@@ -0,0 +1,76 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Loki push API interface library (vendored subset).
+
+This is a trimmed vendored copy of the upstream loki-k8s
+``loki_push_api`` library, cut down to the ``LogProxyConsumer`` pieces
+this charm uses: collecting the Loki push endpoints shared over the
+relation and making them available to the charm.
+"""
+
+import json
+import logging
+from typing import Dict, List, Optional
+
+import ops
+
+LIBAPI = 0
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELATION_NAME = "log-proxy"
+
+
+class LogProxyEndpointJoined(ops.RelationEvent):
+    """A Loki push endpoint has become available."""
+
+
+class LogProxyEndpointDeparted(ops.RelationEvent):
+    """A Loki push endpoint is no longer available."""
+
+
+class LogProxyEvents(ops.ObjectEvents):
+    """Events the log proxy consumer can emit."""
+
+    log_proxy_endpoint_joined = ops.EventSource(LogProxyEndpointJoined)
+    log_proxy_endpoint_departed = ops.EventSource(LogProxyEndpointDeparted)
+
+
+class LogProxyConsumer(ops.Object):
+    """Consumer side of the loki_push_api relation."""
+
+    on = LogProxyEvents()  # type: ignore[reportAssignmentType]
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        relation_name: str = DEFAULT_RELATION_NAME,
+        logs_scheme: Optional[Dict[str, dict]] = None,
+    ):
+        super().__init__(charm, relation_name)
+        self._charm = charm
+        self._relation_name = relation_name
+        self._logs_scheme = logs_scheme or {}
+        events = charm.on[relation_name]
+        self.framework.observe(events.relation_changed, self._on_relation_changed)
+        self.framework.observe(events.relation_departed, self._on_relation_departed)
+
+    def _on_relation_changed(self, event: ops.RelationChangedEvent):
+        if self.loki_endpoints:
+            self.on.log_proxy_endpoint_joined.emit(event.relation)
+
+    def _on_relation_departed(self, event: ops.RelationDepartedEvent):
+        self.on.log_proxy_endpoint_departed.emit(event.relation)
+
+    @property
+    def loki_endpoints(self) -> List[dict]:
+        """The Loki push API endpoints shared by the provider units."""
+        endpoints = []
+        for relation in self._charm.model.relations[self._relation_name]:
+            for unit in relation.units:
+                raw = relation.data[unit].get("endpoint")
+                if raw:
+                    endpoints.append(json.loads(raw))
+        return endpoints
@@ -0,0 +1,61 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Prometheus scrape interface library (vendored subset).
+
+This is a trimmed vendored copy of the upstream prometheus-k8s
+``prometheus_scrape`` library, cut down to the provider side that this
+charm uses: publishing the static scrape jobs for the workload.
+"""
+
+import json
+import logging
+import socket
+from typing import List, Optional
+
+import ops
+
+LIBAPI = 0
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELATION_NAME = "metrics-endpoint"
+DEFAULT_JOBS = [{"metrics_path": "/metrics", "static_configs": [{"targets": ["*:80"]}]}]
+
+
+class MetricsEndpointProvider(ops.Object):
+    """Provider side of the metrics-endpoint relation."""
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        relation_name: str = DEFAULT_RELATION_NAME,
+        jobs: Optional[List[dict]] = None,
+    ):
+        super().__init__(charm, relation_name)
+        self._charm = charm
+        self._relation_name = relation_name
+        self._jobs = jobs if jobs is not None else DEFAULT_JOBS
+        events = charm.on[relation_name]
+        self.framework.observe(events.relation_joined, self._set_scrape_job_spec)
+        self.framework.observe(events.relation_changed, self._set_scrape_job_spec)
+
+    def _set_scrape_job_spec(self, event: ops.RelationEvent):
+        event.relation.data[self._charm.unit]["prometheus_scrape_unit_address"] = (
+            socket.getfqdn()
+        )
+        event.relation.data[self._charm.unit]["prometheus_scrape_unit_name"] = (
+            self._charm.unit.name
+        )
+        if not self._charm.unit.is_leader():
+            return
+        event.relation.data[self._charm.app]["scrape_jobs"] = json.dumps(self._jobs)
+        event.relation.data[self._charm.app]["scrape_metadata"] = json.dumps(
+            {
+                "model": self._charm.model.name,
+                "model_uuid": self._charm.model.uuid,
+                "application": self._charm.app.name,
+                "unit": self._charm.unit.name,
+            }
+        )
@@ -0,0 +1,120 @@
+# Copyright 2023 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Interface library for ingress (vendored subset).
+
+This is a trimmed vendored copy of the upstream traefik-k8s ``ingress``
+library, cut down to the requirer side that this charm uses.
+"""
+
+import json
+import logging
+import socket
+from typing import Optional
+
+import ops
+
+LIBAPI = 2
+LIBPATCH = 1
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELATION_NAME = "ingress"
+
+
+class IngressPerAppReadyEvent(ops.RelationEvent):
+    """The ingress URL for this application is available."""
+
+    @property
+    def url(self) -> Optional[str]:
+        """The published URL."""
+        if not self.relation.app:
+            return None
+        raw = self.relation.data[self.relation.app].get("ingress")
+        if not raw:
+            return None
+        return json.loads(raw).get("url")
+
+
+class IngressPerAppRevokedEvent(ops.RelationEvent):
+    """The ingress URL for this application has been revoked."""
+
+
+class IngressPerAppRequirerEvents(ops.ObjectEvents):
+    """Ingress events the requirer side can emit."""
+
+    ready = ops.EventSource(IngressPerAppReadyEvent)
+    revoked = ops.EventSource(IngressPerAppRevokedEvent)
+
+
+class IngressPerAppRequirer(ops.Object):
+    """Requirer side of the ingress-per-app relation."""
+
+    on = IngressPerAppRequirerEvents()  # type: ignore[reportAssignmentType]
+
+    def __init__(
+        self,
+        charm: ops.CharmBase,
+        relation_name: str = DEFAULT_RELATION_NAME,
+        *,
+        port: Optional[int] = None,
+        strip_prefix: bool = False,
+    ):
+        super().__init__(charm, relation_name)
+        self.charm = charm
+        self.relation_name = relation_name
+        self._port = port
+        self._strip_prefix = strip_prefix
+        self.framework.observe(
+            charm.on[relation_name].relation_joined, self._on_relation_joined
+        )
+        self.framework.observe(
+            charm.on[relation_name].relation_changed, self._on_relation_changed
+        )
+        self.framework.observe(
+            charm.on[relation_name].relation_broken, self._on_relation_broken
+        )
+
+    def _publish_requirer_data(self, relation: ops.Relation):
+        relation.data[self.charm.unit]["host"] = json.dumps(socket.getfqdn())
+        if not self.charm.unit.is_leader():
+            return
+        app_data = {
+            "name": self.charm.app.name,
+            "model": self.charm.model.name,
+            "port": self._port,
+            "strip-prefix": self._strip_prefix,
+        }
+        relation.data[self.charm.app].update(
+            {key: json.dumps(value) for key, value in app_data.items() if value is not None}
+        )
+
+    def _on_relation_joined(self, event: ops.RelationJoinedEvent):
+        self._publish_requirer_data(event.relation)
+
+    def _on_relation_changed(self, event: ops.RelationChangedEvent):
+        if self._url_from(event.relation):
+            self.on.ready.emit(event.relation)
+
+    def _on_relation_broken(self, event: ops.RelationBrokenEvent):
+        self.on.revoked.emit(event.relation)
+
+    def _url_from(self, relation: ops.Relation) -> Optional[str]:
+        if not relation.app:
+            return None
+        raw = relation.data[relation.app].get("ingress")
+        if not raw:
+            return None
+        return json.loads(raw).get("url")
+
+    @property
+    def url(self) -> Optional[str]:
+        """The published ingress URL, if the provider has shared one."""
+        relation = self.charm.model.get_relation(self.relation_name)
+        if relation is None:
+            return None
+        return self._url_from(relation)
+
+    def is_ready(self) -> bool:
+        """Whether the provider has published an ingress URL."""
+        return self.url is not None
@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+# Copyright 2023 Tony Meyer
+# See LICENSE file for licensing details.
+
+"""Charm the Takahē ActivityPub server."""
+
+import dataclasses
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import secrets
+import string
+import types
+import typing
+
+import ops
+
+if typing.TYPE_CHECKING:
+    from charms.data_platform_libs.v0.data_interfaces import DatabaseCreatedEvent
+
+logger = logging.getLogger(__name__)
+
+PEER_RELATION_NAME = "takahe-peer"
+
+HELPERS_PATH = "/takahe/ops_helpers.py"
+
+# Static configuration for the observability providers. These are plain
+# lists/dicts (not frozen proxies) because the libraries serialize them;
+# hoisting them here means they're built once at import, not per hook.
+_METRICS_JOBS = [{"static_configs": [{"targets": ["*:8444"]}]}]
+_LOGS_SCHEME = {
+    "takahe-web": {"log-files": ["/takahe/web.log"]},
+    "takahe-background": {"log-files": ["/takahe/stator.log"]},
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _helpers_source() -> str:
+    """The source of the helper script pushed into the workload."""
+    return pathlib.Path(__file__).with_name("ops_helpers.py").read_text()
+
+
+@dataclasses.dataclass(frozen=True)
+class _ContainerSpec:
+    """Static details of one of the workload containers."""
+
+    summary: str
+    command: str
+    update_version: bool
+
+
+_CONTAINER_DETAILS: typing.Mapping[str, _ContainerSpec] = types.MappingProxyType(
+    {
+        "takahe-web": _ContainerSpec(
+            summary="takahē web server",
+            command="gunicorn takahe.wsgi:application -b 0.0.0.0:8001",
+            update_version=False,
+        ),
+        "takahe-background": _ContainerSpec(
+            summary="takahē background worker (stator)",
+            command="python3 manage.py runstator",
+            update_version=True,
+        ),
+    }
+)
+
+
+def _canonical_services(services: dict) -> bytes:
+    """Serialize a Pebble services dict to canonical JSON.
+
+    Plan equality is a single bytes comparison on this form, and the
+    peer-databag etag is a blake2b digest of it.
+    """
+    return json.dumps(services, sort_keys=True, separators=(",", ":")).encode()
+
+
+class TakahēOperatorCharm(ops.CharmBase):
+    """Charm the Takahē service."""
+
+    web_service_name = "takahe-web"
+    background_service_name = "takahe-background"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Imported here rather than at module level: every Juju hook pays
+        # the import cost of these libraries, even the frequent short ones
+        # that never touch them.
+        from charms.data_platform_libs.v0.data_interfaces import DatabaseRequires
+        from charms.traefik_k8s.v2.ingress import IngressPerAppRequirer
+
+        self.database = DatabaseRequires(self, relation_name="database", database_name="takahe")
+        self._db_secret_labels: typing.Dict[int, str] = {}
+        # Environment entries that do not depend on config, secrets, or
+        # relations. Only a secret-changed event needs to look for a newer
+        # revision of the secret key; everything else tracks the current one.
+        self._base_env = {
+            "TAKAHE_USE_PROXY_HEADERS": "true",
+            "TAKAHE_ENVIRONMENT": "production",
+        }
+        self._refresh_secret_content = False
+        self.ingress = IngressPerAppRequirer(self, port=8001, strip_prefix=True)
+        # The observability providers do non-trivial setup work in their
+        # constructors, and their events only fire while the relation is
+        # in scope - so skip construction (and the library import)
+        # entirely on the many hooks where the relation isn't there.
+        if self._relation_in_scope("grafana-dashboard"):
+            from charms.grafana_k8s.v0.grafana_dashboard import GrafanaDashboardProvider
+
+            self._grafana_dashboards = GrafanaDashboardProvider(
+                self, relation_name="grafana-dashboard"
+            )
+        if self._relation_in_scope("metrics-endpoint"):
+            from charms.prometheus_k8s.v0.prometheus_scrape import MetricsEndpointProvider
+
+            self._prometheus_scraping = MetricsEndpointProvider(
+                self, relation_name="metrics-endpoint", jobs=_METRICS_JOBS
+            )
+        if self._relation_in_scope("log-proxy"):
+            from charms.loki_k8s.v0.loki_push_api import LogProxyConsumer
+
+            self._log_proxy = LogProxyConsumer(
+                self, relation_name="log-proxy", logs_scheme=_LOGS_SCHEME
+            )
+        for container_name in (self.web_service_name, self.background_service_name):
+            self.framework.observe(self.on[container_name].pebble_ready, self._on_pebble_ready)
+        self.framework.observe(self.on.start, self._on_start)
+        self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.secret_changed, self._on_secret_changed)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        self.framework.observe(self.on.collect_unit_status, self._on_collect_status)
+        self.framework.observe(self.on.add_superuser_action, self._on_add_superuser_action)
+        self.framework.observe(self.database.on.database_created, self._on_database_created)
+        self.framework.observe(
+            self.database.on.endpoints_changed, self._on_database_endpoints_changed
+        )
+        self.framework.observe(self.ingress.on.ready, self._on_ingress_ready)
+        self.framework.observe(self.ingress.on.revoked, self._on_ingress_revoked)
+
+    def _relation_in_scope(self, relation_name: str) -> bool:
+        """Whether a library for this relation needs constructing.
+
+        model.relations omits a relation for the duration of its own
+        broken hook, but the libraries must still be constructed then so
+        that their teardown observers run.
+        """
+        if self.model.relations.get(relation_name):
+            return True
+        return os.environ.get("JUJU_RELATION") == relation_name
+
+    @property
+    def peers(self) -> typing.Optional[ops.Relation]:
+        """The peer relation, if it has been created yet."""
+        return self.model.get_relation(PEER_RELATION_NAME)
+
+    def _db_secret_label(self, relation: ops.Relation) -> str:
+        """The label of the secret holding the database credentials.
+
+        The label is a pure function of the relation ID, so compute it at
+        most once per relation per hook.
+        """
+        try:
+            return self._db_secret_labels[relation.id]
+        except KeyError:
+            from charms.data_platform_libs.v0.data_interfaces import SECRET_GROUPS
+
+            label = self.database._generate_secret_label(
+                "database", relation.id, SECRET_GROUPS.USER
+            )
+            self._db_secret_labels[relation.id] = label
+            return label
+
+    @functools.cached_property
+    def dsn(self) -> typing.Optional[str]:
+        """The PostgreSQL connection string, if a database is available.
+
+        The result is cached on the instance: nothing that contributes to
+        the DSN can change within a single hook, so the relation and secret
+        round-trips are only paid once per event. Handlers that change the
+        inputs pop the cache before using it.
+        """
+        relation = self.model.get_relation("database")
+        if relation is None:
+            return None
+        try:
+            content = self.model.get_secret(label=self._db_secret_label(relation)).get_content()
+            user = content["username"]
+            password = content["password"]
+        except (ops.SecretNotFoundError, KeyError):
+            return None
+        endpoints = self.database.fetch_relation_field(relation.id, "endpoints")
+        if not endpoints:
+            return None
+        return f"postgres://{user}:{password}@{endpoints.split(',')[0]}/takahe"
+
+    @functools.cached_property
+    def _takahē_env(self) -> typing.Optional[dict]:
+        """The environment to run the Takahē services with.
+
+        Returns None when a prerequisite (peer data, the secret key, the
+        database, or storage) is not available yet; the collect-status
+        handler reports the specific gap. Cached per event, like `dsn` -
+        re-reading the secret on every access within one hook only repeats
+        the same Juju RPCs.
+        """
+        peers = self.peers
+        if peers is None or "secret-key-id" not in peers.data[self.app]:
+            return None
+        secret = self.model.get_secret(id=peers.data[self.app]["secret-key-id"])
+        secret_key = secret.get_content(refresh=self._refresh_secret_content).get("secret-key")
+        if not secret_key:
+            return None
+        dsn = self.dsn
+        if dsn is None:
+            return None
+        storages = self.model.storages["local-media"]
+        if not storages:
+            return None
+        config = self.config
+        main_domain = config.get("main-domain", "")
+        env = dict(self._base_env)
+        env.update(
+            {
+                "TAKAHE_DATABASE_SERVER": dsn,
+                "TAKAHE_SECRET_KEY": secret_key,
+                "TAKAHE_MAIN_DOMAIN": main_domain,
+                "TAKAHE_CSRF_HOSTS": f'["https://{main_domain}"]',
+                "TAKAHE_MEDIA_BACKEND": config["media-uri"],
+                "TAKAHE_MEDIA_ROOT": str(storages[0].location),
+            }
+        )
+        return env
+
+    @functools.cached_property
+    def workload_version(self) -> str:
+        """The version of Takahē found in the workload container.
+
+        Cached on the instance: the version cannot change within a hook,
+        and the exec is a full interpreter start inside the container.
+        """
+        container = self.unit.get_container(self.background_service_name)
+        process = container.exec(["python", "-c", "import takahe;print(takahe.__version__)"])
+        version, _ = process.wait_output()
+        return version.strip()
+
+    @staticmethod
+    def _generate_secret_key(length: int = 128) -> str:
+        """Generate a suitable Django secret key."""
+        alphabet = string.ascii_uppercase + string.digits
+        return "".join(secrets.choice(alphabet) for _ in range(length))
+
+    def _replan(self, container: ops.Container, env: typing.Optional[dict] = None):
+        """Ensure that the Pebble plan for the service is up to date.
+
+        Callers that replan several containers pass the environment in
+        explicitly so that it is only assembled once for the hook.
+        """
+        if env is None:
+            env = self._takahē_env
+        if env is None:
+            logger.debug("Not replanning %s: environment is incomplete", container.name)
+            return
+        spec = _CONTAINER_DETAILS[container.name]
+        new_services = {
+            container.name: {
+                "override": "replace",
+                "summary": spec.summary,
+                "command": spec.command,
+                "startup": "enabled",
+                "environment": env,
+            }
+        }
+        new_canonical = _canonical_services(new_services)
+        new_digest = hashlib.blake2b(new_canonical).hexdigest()
+        peers = self.peers
+        etag_key = f"plan-hash-{container.name}"
+        if peers is not None and peers.data[self.unit].get(etag_key) == new_digest:
+            # We already pushed exactly this plan: skip the get_plan RPC.
+            logger.debug("Plan for %s is unchanged; not replanning", container.name)
+        else:
+            services = container.get_plan().to_dict().get("services", {})
+            if _canonical_services(services) != new_canonical:
+                layer = ops.pebble.Layer(
+                    {
+                        "summary": spec.summary,
+                        "description": f"pebble config layer for {container.name}",
+                        "services": new_services,
+                    }
+                )
+                container.add_layer(container.name, layer, combine=True)
+                logger.info("Added updated layer %r to Pebble plan", container.name)
+                container.replan()
+                logger.info("Replanned %s with updated layer", container.name)
+            if peers is not None:
+                peers.data[self.unit][etag_key] = new_digest
+        if spec.update_version:
+            self.unit.set_workload_version(self.workload_version)
+
+    def _safe_replan(
+        self,
+        container: ops.Container,
+        event: ops.EventBase,
+        env: typing.Optional[dict] = None,
+    ) -> bool:
+        """Replan one service, deferring the event if Pebble is not ready.
+
+        Returns True if the replan succeeded.
+        """
+        try:
+            self._replan(container, env)
+        except ops.pebble.ConnectionError:
+            logger.debug("Unable to connect to Pebble in %s", container.name)
+            self.unit.status = ops.WaitingStatus("Waiting for Pebble in workload container")
+            event.defer()
+            return False
+        except ops.pebble.ChangeError:
+            logger.exception("Unable to restart %s", container.name)
+            self.unit.status = ops.MaintenanceStatus("Waiting to retry replan")
+            event.defer()
+            return False
+        return True
+
+    def _reset_services_or_defer(self, event: ops.EventBase):
+        """Replan both services, deferring the event if Pebble is not ready."""
+        env = self._takahē_env
+        if env is None:
+            logger.debug("Not replanning: environment is incomplete")
+            return
+        for container_name in (self.web_service_name, self.background_service_name):
+            if not self._safe_replan(self.unit.get_container(container_name), event, env):
+                # The replay will replan both containers; don't do half
+                # the work twice.
+                return
+
+    def _on_start(self, event: ops.StartEvent):
+        """Ensure that the shared Django secret key exists."""
+        if not self.unit.is_leader():
+            return
+        peers = self.peers
+        if peers is None:
+            event.defer()
+            return
+        if "secret-key-id" not in peers.data[self.app]:
+            secret = self.app.add_secret({"secret-key": self._generate_secret_key()})
+            peers.data[self.app]["secret-key-id"] = typing.cast(str, secret.id)
+
+    def _on_config_changed(self, event: ops.ConfigChangedEvent):
+        self.__dict__.pop("_takahē_env", None)
+        self.__dict__.pop("dsn", None)
+        self._reset_services_or_defer(event)
+
+    def _on_secret_changed(self, event: ops.SecretChangedEvent):
+        self._refresh_secret_content = True
+        self.__dict__.pop("_takahē_env", None)
+        self.__dict__.pop("dsn", None)
+        peers = self.peers
+        if peers is not None:
+            peers.data[self.unit].pop("validated-secret-id", None)
+        self._reset_services_or_defer(event)
+
+    @staticmethod
+    def _push_helpers(container: ops.Container):
+        """Ensure the workload has the current version of the helper script."""
+        container.push(HELPERS_PATH, _helpers_source(), make_dirs=True)
+
+    def _on_pebble_ready(self, event: ops.PebbleReadyEvent):
+        # The etag in the peer databag outlives the workload pod, but the
+        # Pebble plan does not: after a reschedule the fresh Pebble has no
+        # layer even though the stored digest still matches. Drop the etag
+        # so this path always re-pushes the layer.
+        peers = self.peers
+        if peers is not None:
+            peers.data[self.unit].pop(f"plan-hash-{event.workload.name}", None)
+        try:
+            self._push_helpers(event.workload)
+        except ops.pebble.ConnectionError:
+            logger.debug("Unable to connect to Pebble in %s", event.workload.name)
+            self.unit.status = ops.WaitingStatus("Waiting for Pebble in workload container")
+            event.defer()
+            return
+        self._safe_replan(event.workload, event)
+
+    def _on_upgrade_charm(self, event: ops.UpgradeCharmEvent):
+        """Apply any schema changes that came with the new version."""
+        # The new charm revision may ship a new workload image.
+        self.__dict__.pop("workload_version", None)
+        env = self._takahē_env
+        if env is None:
+            logger.debug("Not migrating: environment is incomplete")
+            return
+        container = self.unit.get_container(self.background_service_name)
+        self.unit.status = ops.MaintenanceStatus("Upgrading database tables...")
+        try:
+            self._push_helpers(container)
+            # One exec migrates and reports the new version, so the replan
+            # below doesn't need to start another interpreter for it.
+            process = container.exec(
+                ["python3", HELPERS_PATH, "upgrade"], working_dir="/takahe", environment=env
+            )
+            stdout, _ = process.wait_output()
+            self.__dict__["workload_version"] = stdout.strip().rsplit("\n", 1)[-1]
+        except ops.pebble.ConnectionError:
+            logger.debug("Unable to connect to Pebble in %s", container.name)
+            self.unit.status = ops.WaitingStatus("Waiting for Pebble in workload container")
+            event.defer()
+            return
+        except ops.pebble.ExecError:
+            logger.exception("Unable to migrate database tables")
+            self.unit.status = ops.MaintenanceStatus("Waiting to retry migration")
+            event.defer()
+            return
+        self.unit.status = ops.MaintenanceStatus("Restarting service...")
+        if self._safe_replan(container, event, env):
+            self._safe_replan(self.unit.get_container(self.web_service_name), event, env)
+
+    def _on_database_created(self, event: "DatabaseCreatedEvent"):
+        """Create the database tables once credentials are available."""
+        self.__dict__.pop("_takahē_env", None)
+        self.__dict__.pop("dsn", None)
+        env = self._takahē_env
+        if env is None:
+            logger.debug("Not migrating: environment is incomplete")
+            event.defer()
+            return
+        container = self.unit.get_container(self.background_service_name)
+        self.unit.status = ops.MaintenanceStatus("Creating database tables...")
+        try:
+            # This event may land before pebble-ready has pushed the
+            # helpers (or after a pod restart wiped them).
+            self._push_helpers(container)
+            process = container.exec(
+                ["python3", HELPERS_PATH, "migrate"], working_dir="/takahe", environment=env
+            )
+            process.wait()
+        except ops.pebble.ConnectionError:
+            logger.debug("Unable to connect to Pebble in %s", container.name)
+            self.unit.status = ops.WaitingStatus("Waiting for Pebble in workload container")
+            event.defer()
+            return
+        except ops.pebble.ExecError:
+            logger.exception("Unable to create database tables")
+            self.unit.status = ops.MaintenanceStatus("Waiting to retry migration")
+            event.defer()
+            return
+        if self._safe_replan(container, event, env):
+            self._safe_replan(self.unit.get_container(self.web_service_name), event, env)
+
+    def _on_database_endpoints_changed(self, event: ops.EventBase):
+        """The database moved; rebuild the DSN and restart the services."""
+        self.__dict__.pop("_takahē_env", None)
+        self.__dict__.pop("dsn", None)
+        self._reset_services_or_defer(event)
+
+    def _on_ingress_ready(self, event: ops.EventBase):
+        logger.info("Ingress is ready")
+        self._reset_services_or_defer(event)
+
+    def _on_ingress_revoked(self, event: ops.EventBase):
+        logger.info("Ingress has been revoked")
+        self._reset_services_or_defer(event)
+
+    def _on_add_superuser_action(self, event: ops.ActionEvent):
+        """Create a superuser account with a generated password."""
+        env = self._takahē_env
+        if env is None:
+            event.fail("Takahē is not ready to create accounts")
+            return
+        email = event.params["email"]
+        password = self._generate_secret_key(24)
+        env = dict(env)
+        env["DJANGO_SUPERUSER_EMAIL"] = email
+        env["DJANGO_SUPERUSER_PASSWORD"] = password
+        container = self.unit.get_container(self.background_service_name)
+        try:
+            self._push_helpers(container)
+            process = container.exec(
+                ["python3", HELPERS_PATH, "createsuperuser"],
+                working_dir="/takahe",
+                environment=env,
+            )
+            process.wait_output()
+        except ops.pebble.ConnectionError:
+            event.fail("Unable to connect to Pebble in workload container")
+            return
+        except ops.pebble.ExecError as e:
+            event.fail(f"Unable to create superuser: {e.stderr}")
+            return
+        event.set_results({"email": email, "password": password})
+
+    def _on_collect_status(self, event: ops.CollectStatusEvent):
+        """Report the current status of the unit.
+
+        Checks are ordered cheapest first (plain config reads before
+        anything that costs a Juju RPC), and a terminal blocked status
+        short-circuits the rest: collect-unit-status is the most
+        frequently run hook, so in the steady "blocked on config" states
+        we avoid the secret and relation round-trips entirely.
+        """
+        config = self.config
+        media_uri = config["media-uri"]
+        main_domain = config.get("main-domain")
+        if not main_domain:
+            event.add_status(ops.BlockedStatus("missing required 'main-domain' configuration"))
+            return
+        if media_uri and not media_uri.startswith(("local://", "s3://", "gs://")):
+            event.add_status(ops.BlockedStatus(f"unsupported 'media-uri' {media_uri!r}"))
+            return
+        if self.model.get_relation("database") is None:
+            event.add_status(ops.BlockedStatus("missing required database relation"))
+            return
+        if not self.model.storages["local-media"] and media_uri.startswith("local://"):
+            event.add_status(ops.WaitingStatus("Waiting for media storage"))
+        peers = self.peers
+        if peers is None or "secret-key-id" not in peers.data[self.app]:
+            event.add_status(ops.WaitingStatus("Waiting for secret key"))
+        else:
+            secret_id = peers.data[self.app]["secret-key-id"]
+            # Only read the content the first time we see this secret;
+            # secret-changed clears the marker so rotation is revalidated.
+            if peers.data[self.unit].get("validated-secret-id") != secret_id:
+                secret = self.model.get_secret(id=secret_id)
+                if not secret.get_content().get("secret-key"):
+                    event.add_status(ops.BlockedStatus("Secret key is empty"))
+                    return
+                peers.data[self.unit]["validated-secret-id"] = secret_id
+        if self.dsn is None:
+            event.add_status(ops.WaitingStatus("Waiting for database credentials"))
+        if self.model.get_relation("ingress") is not None and not self.ingress.is_ready():
+            event.add_status(ops.WaitingStatus("Waiting for ingress"))
+        event.add_status(ops.ActiveStatus())
+
+
+if __name__ == "__main__":  # pragma: nocover
+    ops.main(TakahēOperatorCharm)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Copyright 2023 Tony Meyer
+# See LICENSE file for licensing details.
+
+"""Operational helpers run inside the Takahē workload container.
+
+The charm pushes this file to /takahe/ops_helpers.py so that each
+operation - and in particular multi-step ones like `upgrade` - costs a
+single interpreter start inside the container, rather than one per step.
+"""
+
+import os
+import sys
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "takahe.settings")
+
+
+def version():
+    """Print the installed Takahē version."""
+    import takahe
+
+    print(takahe.__version__)
+
+
+def migrate():
+    """Apply any outstanding database migrations."""
+    from django.core import management
+
+    management.call_command("migrate")
+
+
+def createsuperuser():
+    """Create a superuser from the DJANGO_SUPERUSER_* environment."""
+    from django.core import management
+
+    management.call_command("createsuperuser", interactive=False)
+
+
+def upgrade():
+    """Migrate, then print the installed version (on the last line)."""
+    migrate()
+    version()
+
+
+_COMMANDS = {fn.__name__: fn for fn in (version, migrate, createsuperuser, upgrade)}
+
+if __name__ == "__main__":
+    _COMMANDS[sys.argv[1]]()
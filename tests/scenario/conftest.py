@@ -0,0 +1,38 @@
+# Copyright 2023 Tony Meyer
+# See LICENSE file for licensing details.
+
+"""Shared fixtures for the scenario tests."""
+
+import pathlib
+
+import pytest
+import scenario
+import yaml
+
+from charm import TakahēOperatorCharm
+
+# Use the libyaml implementation where available: it is an order of
+# magnitude faster than the pure-Python one.
+try:
+    _SAFE_LOADER = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without libyaml.
+    _SAFE_LOADER = yaml.SafeLoader
+
+# Loaded when the module is imported, during collection: the parse happens
+# exactly once and before any test is timed, regardless of fixture
+# resolution order. Reading the raw bytes hands them straight to libyaml
+# (no Python-side buffered decoding), and anchoring the path to this file
+# makes the tests independent of the working directory.
+_META_BYTES = pathlib.Path(__file__).parents[2].joinpath("charmcraft.yaml").read_bytes()
+_META = yaml.load(_META_BYTES, Loader=_SAFE_LOADER)
+
+
+@pytest.fixture(scope="session")
+def ctx():
+    # One Context for the whole session (per xdist worker): the charm
+    # type, meta, actions, and config never vary, and each run() takes a
+    # fresh State. Tests that assert on the accumulating history slices
+    # it relative to its length before the run.
+    return scenario.Context(
+        TakahēOperatorCharm, meta=_META, actions=_META["actions"], config=_META["config"]
+    )